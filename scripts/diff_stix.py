@@ -1,13 +1,18 @@
 import argparse
-from stix2 import MemoryStore, Filter, TAXIICollectionSource
+from stix2 import MemoryStore, Filter
 from taxii2client import Collection
 import os
 import json
 from tqdm import tqdm
 import datetime
 from string import Template
-from itertools import chain
-from dateutil import parser as dateparser
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson # optional, parses large bundles considerably faster than the json module
+except ModuleNotFoundError:
+    orjson = None
 
 # helper maps
 domainToDomainLabel = {
@@ -25,12 +30,20 @@ domainToTaxiiCollectionId = {
     "mobile-attack": "2f669986-b40b-4423-b720-4396ca6a462b",
     "pre-attack": "062767bd-02d2-4b72-84ba-56caef0f8658"
 }
-attackTypeToStixFilter = { # stix filters for querying for each type of data
-    'technique': [Filter('type', '=', 'attack-pattern')],
-    'software': [Filter('type', '=', 'malware'), Filter('type', '=', 'tool')],
-    'group': [Filter('type', '=', 'intrusion-set')],
-    'mitigation': [Filter('type', '=', 'course-of-action')]
+attackTypeToStixTypes = { # stix types making up each type of data
+    'technique': frozenset({'attack-pattern'}),
+    'software': frozenset({'malware', 'tool'}),
+    'group': frozenset({'intrusion-set'}),
+    'mitigation': frozenset({'course-of-action'})
 }
+subtechniqueOfFilters = [ # stix filters for querying sub-technique-of relationships
+    Filter("type", "=", "relationship"),
+    Filter("relationship_type", "=", "subtechnique-of")
+]
+revokedByFilters = [ # stix filters for querying revoked-by relationships
+    Filter("type", "=", "relationship"),
+    Filter("relationship_type", "=", "revoked-by")
+]
 attackTypeToPlural = { # because some of these pluralize differently
     'technique': 'techniques',
     'malware': 'malware',
@@ -62,6 +75,9 @@ statusDescriptions = { # explanation of modification types to data objects for l
     "deprecations": "objects which are deprecated in the new data but not in the old",
     "deletions": "objects which are present in the old data but not the new"
 }
+statusToLegendItem = { # legend item for each modification type in layer files
+    status: {"color": statusToColor[status], "label": status + ": " + statusDescriptions[status]} for status in statusToColor
+}
 
 class DiffStix(object):
     """
@@ -127,6 +143,7 @@ class DiffStix(object):
         self.old_subtechnique_of_rels = [] # all subtechnique-of relationships in the old data
         self.new_id_to_technique = {} # stixID => technique for every technique in the new data
         self.old_id_to_technique = {} # stixID => technique for every technique in the old data
+        self.have_deletions = False # true if any type in any domain has deletions
         # build the bove data structures
         self.load_data()
         # remove duplicate relationships
@@ -144,33 +161,19 @@ class DiffStix(object):
         Parse the website url from a stix object.
         """
         url = datum['external_references'][0]['url']
-        split_url = url.split('/')
-        splitfrom = -3 if is_subtechnique else -2
-        link = '/'.join(split_url[splitfrom:])
-        return link
+        # find the slash before the last two path segments (three for sub-techniques) without splitting the url
+        start = len(url)
+        for _ in range(3 if is_subtechnique else 2):
+            start = url.rfind('/', 0, start)
+            if start == -1: break
+        return url[start + 1:]
 
 
-    def deep_copy_stix(self, objects):
+    def stix_to_dict(self, obj):
         """
-        Transform stix to dict and deep copy the dict.
+        Transform a stix object into a plain dict for the output stage.
         """
-        result = []
-        for obj in objects:
-            obj = dict(obj)
-            if 'external_references' in obj:
-                for i in range(len(obj['external_references'])):
-                    obj['external_references'][i] = dict(
-                        obj['external_references'][i])
-            if 'kill_chain_phases' in obj:
-                for i in range(len(obj['kill_chain_phases'])):
-                    obj['kill_chain_phases'][i] = dict(obj['kill_chain_phases'][i])
-            if 'modified' in obj:
-                obj['modified'] = str(obj['modified'])
-            if 'definition' in obj:
-                obj['definition'] = dict(obj['definition'])
-            obj['created'] = str(obj['created'])
-            result.append(obj)
-        return result
+        return json.loads(obj.serialize())
 
 
     # load data into data structure
@@ -178,131 +181,173 @@ class DiffStix(object):
         """
         Load data from files into data dict.
         """
+        # parse an x_mitre_version string into a tuple so that e.g 1.10 compares greater than 1.9.
+        # trailing zeros are dropped so that 1 and 1.0 compare equal
+        def parse_version(item):
+            try:
+                version = [int(part) for part in str(item["x_mitre_version"]).split(".")]
+            except (KeyError, ValueError):
+                return None
+            while version and version[-1] == 0:
+                version.pop()
+            return tuple(version)
+
+        # handle data loaded from either a directory or the TAXII server
+        def load_datastore(store, obj_type):
+            raw_data = [
+                item for stix_type in attackTypeToStixTypes[obj_type] for item in store["by_type"][stix_type]
+            ]
+            id_to_obj = {item['id']: item for item in raw_data}
+
+            return {
+                "id_to_obj": id_to_obj,
+                "id_to_version": {item['id']: parse_version(item) for item in raw_data},
+                "revoked_by_map": store["revoked_by_map"]
+            }
+
+        # bucket the objects of a data store by stix type in a single pass
+        def index_datastore(data_store):
+            by_type = defaultdict(list)
+            for item in data_store.query([]):
+                by_type[item['type']].append(item)
+            # query the revoked-by relationships once rather than once per revoked object.
+            # if an object has several, keep the first one like the per-object query did
+            revoked_by_map = {}
+            for rel in data_store.query(revokedByFilters):
+                revoked_by_map.setdefault(rel["source_ref"], rel["target_ref"])
+            return {
+                "by_type": by_type,
+                "revoked_by_map": revoked_by_map,
+                "data_store": data_store
+            }
+
+        def parse_subtechniques(store, new=False):
+            # parse dataStore sub-technique-of relationships
+            data_store = store["data_store"]
+            if new: 
+                for technique in store["by_type"]["attack-pattern"]:
+                    self.new_id_to_technique[technique["id"]] = technique
+                self.new_subtechnique_of_rels += list(data_store.query(subtechniqueOfFilters))
+            else:
+                for technique in store["by_type"]["attack-pattern"]:
+                    self.old_id_to_technique[technique["id"]] = technique
+                self.old_subtechnique_of_rels += list(data_store.query(subtechniqueOfFilters))
+
+        # load data from directory according to domain
+        def load_dir(dir, domain):
+            data_store = MemoryStore()
+            datafile = os.path.join(dir, domain + ".json")
+            with open(datafile, "rb") as f:
+                bundle = orjson.loads(f.read()) if orjson else json.load(f)
+            data_store.add(bundle)
+            return index_datastore(data_store)
+
+        # load data from TAXII server according to domain
+        def load_taxii(domain):
+            collection = Collection("https://cti-taxii.mitre.org/stix/collections/" + domainToTaxiiCollectionId[domain])
+            # download the whole bundle once so later queries don't each make a request to the server
+            data_store = MemoryStore()
+            data_store.add(collection.get_objects())
+            return index_datastore(data_store)
+
+        # load each domain once and share the data stores across all types.
+        # the old and new data for every domain is loaded in parallel
+        with ThreadPoolExecutor(max_workers=max(1, 2 * len(self.domains))) as executor:
+            if self.use_taxii:
+                old_futures = {domain: executor.submit(load_taxii, domain) for domain in self.domains}
+            else:
+                old_futures = {domain: executor.submit(load_dir, self.old, domain) for domain in self.domains}
+            new_futures = {domain: executor.submit(load_dir, self.new, domain) for domain in self.domains}
+            old_stores = {domain: future.result() for domain, future in old_futures.items()}
+            new_stores = {domain: future.result() for domain, future in new_futures.items()}
+        # parse sub-techniques in domain order so the relationship lists are deterministic
+        for domain in self.domains:
+            parse_subtechniques(old_stores[domain], False)
+            parse_subtechniques(new_stores[domain], True)
+
+        def load_pair(obj_type, domain):
+            return load_datastore(old_stores[domain], obj_type), load_datastore(new_stores[domain], obj_type)
+
         if self.verbose:
             pbar = tqdm(total=len(self.types) * len(self.domains), desc="loading data", bar_format="{l_bar}{bar}| [{elapsed}<{remaining}, {rate_fmt}{postfix}]")
         for obj_type in self.types:
             for domain in self.domains:
-                # handle data loaded from either a directory or the TAXII server
-                def load_datastore(data_store):
-                    raw_data = list(chain.from_iterable(
-                        data_store.query(f) for f in attackTypeToStixFilter[obj_type]
-                    ))
-                    raw_data = self.deep_copy_stix(raw_data)
-                    id_to_obj = {item['id']: item for item in raw_data}
-
-                    return {
-                        "id_to_obj": id_to_obj,
-                        "keys": set(id_to_obj.keys()),
-                        "data_store": data_store
-                    }
-
-                def parse_subtechniques(data_store, new=False):
-                    # parse dataStore sub-technique-of relationships
-                    if new: 
-                        for technique in list(data_store.query(attackTypeToStixFilter["technique"])):
-                            self.new_id_to_technique[technique["id"]] = technique
-                        self.new_subtechnique_of_rels += list(data_store.query([
-                            Filter("type", "=", "relationship"),
-                            Filter("relationship_type", "=", "subtechnique-of")
-                        ]))
-                    else:
-                        for technique in list(data_store.query(attackTypeToStixFilter["technique"])):
-                            self.old_id_to_technique[technique["id"]] = technique
-                        self.old_subtechnique_of_rels += list(data_store.query([
-                            Filter("type", "=", "relationship"),
-                            Filter("relationship_type", "=", "subtechnique-of")
-                        ]))
-
-                # load data from directory according to domain
-                def load_dir(dir, new=False):
-                    data_store = MemoryStore()
-                    datafile = os.path.join(dir, domain + ".json")
-                    data_store.load_from_file(datafile)
-                    parse_subtechniques(data_store, new)
-                    return load_datastore(data_store)
-
-                # load data from TAXII server according to domain
-                def load_taxii(new=False):
-                    collection = Collection("https://cti-taxii.mitre.org/stix/collections/" + domainToTaxiiCollectionId[domain])
-                    data_store = TAXIICollectionSource(collection)
-                    parse_subtechniques(data_store, new)
-                    return load_datastore(data_store)
-
-                if self.use_taxii:
-                    old = load_taxii(False)
-                else:
-                    old = load_dir(self.old, False)
-                new = load_dir(self.new, True)
-
-                intersection = old["keys"] & new["keys"]
-                additions = new["keys"] - old["keys"]
-                deletions = old["keys"] - new["keys"]
+                old, new = load_pair(obj_type, domain)
+                # dict key views support set operations directly, no need to copy them into sets
+                additions = new["id_to_obj"].keys() - old["id_to_obj"].keys()
+                deletions = old["id_to_obj"].keys() - new["id_to_obj"].keys()
+                # objects present in both versions are found by walking the smaller side
+                small, large = (old, new) if len(old["id_to_obj"]) <= len(new["id_to_obj"]) else (new, old)
 
                 # sets to store the ids of objects for each section
                 changes = set()
                 minor_changes = set()
                 revocations = set()
                 deprecations = set()
+                revoked_by = {} # revoked object id => revoking object id
 
                 # find changes, revocations and deprecations
-                for key in intersection:
-                    if "revoked" in new["id_to_obj"][key] and new["id_to_obj"][key]["revoked"]:
-                        if not "revoked" in old["id_to_obj"][key] or not old["id_to_obj"][key]["revoked"]: # if it was previously revoked, it's not a change
+                for key in small["id_to_obj"]:
+                    if key not in large["id_to_obj"]: continue
+                    new_obj = new["id_to_obj"][key]
+                    old_obj = old["id_to_obj"][key]
+                    if new_obj.get("revoked"):
+                        if not old_obj.get("revoked"): # if it was previously revoked, it's not a change
                             # store the revoking object
-                            revoked_by_key = new["data_store"].query([
-                                Filter('type', '=', 'relationship'),
-                                Filter('relationship_type', '=', 'revoked-by'),
-                                Filter('source_ref', '=', key)
-                            ])
-                            if (len(revoked_by_key) == 0): 
+                            if key not in new["revoked_by_map"]:
                                 print("WARNING: revoked object", key, "has no revoked-by relationship")
                                 continue
-                            else: revoked_by_key = revoked_by_key[0]["target_ref"]
-
-                            new["id_to_obj"][key]["revoked_by"] = new["id_to_obj"][revoked_by_key]
 
+                            revoked_by[key] = new["revoked_by_map"][key]
                             revocations.add(key)
                         # else it was already revoked, and not a change; do nothing with it
-                    elif "x_mitre_deprecated" in new["id_to_obj"][key] and new["id_to_obj"][key]["x_mitre_deprecated"]:
-                        if not "x_mitre_deprecated" in old["id_to_obj"][key]:   # if previously deprecated, not a change
+                    elif new_obj.get("x_mitre_deprecated"):
+                        if not old_obj.get("x_mitre_deprecated"):   # if previously deprecated, not a change
                             deprecations.add(key)
                     else: # not revoked or deprecated
-                        # try getting version numbers; should only lack version numbers if something has gone
+                        # get version numbers; should only lack version numbers if something has gone
                         # horribly wrong or a revoked object has slipped through
-                        try:
-                            old_version = float(old["id_to_obj"][key]["x_mitre_version"])
-                        except: 
+                        old_version = old["id_to_version"][key]
+                        new_version = new["id_to_version"][key]
+                        if old_version is None:
                             print("ERROR: cannot get old version for object: " + key)
-                        try:
-                            new_version = float(new["id_to_obj"][key]["x_mitre_version"])
-                        except: 
+                        if new_version is None:
                             print("ERROR: cannot get new version for object: " + key)
+                        if old_version is None or new_version is None:
+                            continue
 
                         # check for changes
                         if new_version > old_version:
                             # an update has occurred to this object
                             changes.add(key)
                         else:
-                            # check for minor change; modification date increased but not version
-                            old_date = dateparser.parse(old["id_to_obj"][key]["modified"])
-                            new_date = dateparser.parse(new["id_to_obj"][key]["modified"])
-                            if new_date > old_date:
+                            # check for minor change; modification date increased but not version.
+                            # stix2 parses modified into a datetime, so no string parsing is needed
+                            if new_obj.modified > old_obj.modified:
                                 minor_changes.add(key)
                 
+                # only objects selected into a section are converted to dicts
+                revocations_data = []
+                for key in revocations:
+                    revoked = self.stix_to_dict(new["id_to_obj"][key])
+                    revoked["revoked_by"] = self.stix_to_dict(new["id_to_obj"][revoked_by[key]])
+                    revocations_data.append(revoked)
+
                 # set data
                 if obj_type not in self.data: self.data[obj_type] = {}
                 self.data[obj_type][domain] = {
-                    "additions":     [new["id_to_obj"][key] for key in additions],
-                    "changes":       [new["id_to_obj"][key] for key in changes]
+                    "additions":     [self.stix_to_dict(new["id_to_obj"][key]) for key in additions],
+                    "changes":       [self.stix_to_dict(new["id_to_obj"][key]) for key in changes]
                 }
                 # only create minor_changes data if we want to display it later
                 if self.minor_changes:
-                    self.data[obj_type][domain]["minor_changes"] = [new["id_to_obj"][key] for key in minor_changes]
-                self.data[obj_type][domain]["revocations"] = [new["id_to_obj"][key] for key in revocations]
-                self.data[obj_type][domain]["deprecations"] = [new["id_to_obj"][key] for key in deprecations]
+                    self.data[obj_type][domain]["minor_changes"] = [self.stix_to_dict(new["id_to_obj"][key]) for key in minor_changes]
+                self.data[obj_type][domain]["revocations"] = revocations_data
+                self.data[obj_type][domain]["deprecations"] = [self.stix_to_dict(new["id_to_obj"][key]) for key in deprecations]
                 # only show deletions if objects were deleted
                 if len(deletions) > 0:
-                    self.data[obj_type][domain]["deletions"] = [old["id_to_obj"][key] for key in deletions]
+                    self.have_deletions = True
+                    self.data[obj_type][domain]["deletions"] = [self.stix_to_dict(old["id_to_obj"][key]) for key in deletions]
                 if self.verbose:
                     pbar.update(1)
         if self.verbose:
@@ -318,12 +363,6 @@ class DiffStix(object):
         Includes deletions if the changes include deletions.
         """
 
-        have_deletions = False
-        for types in self.data.keys():
-            for domain in self.data[types].keys():
-                if "deletions" in self.data[types][domain].keys():
-                    have_deletions = True
-
         key = "#### Key\n\n"
         key += (
             "* New objects: " + statusDescriptions['additions'] + "\n"
@@ -335,15 +374,10 @@ class DiffStix(object):
             "* Object revocations: " + statusDescriptions['revocations'] + "\n"
             "* Object deprecations: " + statusDescriptions['deprecations']
         )
-        if have_deletions:
+        if self.have_deletions:
             key += "\n" + "* Object deletions: " + statusDescriptions['deletions']
         return f"{key}"
 
-    def has_subtechniques(self, sdo, new=False):
-        """return true or false depending on whether the SDO has sub-techniques. new determines whether to parse from the new or old data"""
-        if new: return len(list(filter(lambda rel: rel["target_ref"] == sdo["id"], self.new_subtechnique_of_rels))) > 0
-        else:   return len(list(filter(lambda rel: rel["target_ref"] == sdo["id"], self.old_subtechnique_of_rels))) > 0
-
     def get_markdown_string(self):
         """
         Return a markdown string summarizing detected differences.
@@ -354,10 +388,17 @@ class DiffStix(object):
             parse a list of items in a section and return a string for the items
             """
             
-            # get parents which have children
-            childless = list(filter(lambda item: not self.has_subtechniques(item, True) and not ("x_mitre_is_subtechnique" in item and item["x_mitre_is_subtechnique"]), items))
-            parents = list(filter(lambda item: self.has_subtechniques(item, True) and not ("x_mitre_is_subtechnique" in item and item["x_mitre_is_subtechnique"]), items))
-            children = { item["id"]: item for item in filter(lambda item: "x_mitre_is_subtechnique" in item and item["x_mitre_is_subtechnique"], items) }
+            # split items into childless techniques, parents which have children, and children in a single pass
+            childless = []
+            parents = []
+            children = {}
+            for item in items:
+                if item.get("x_mitre_is_subtechnique"):
+                    children[item["id"]] = item
+                elif item["id"] in parent_ids:
+                    parents.append(item)
+                else:
+                    childless.append(item)
 
             subtechnique_of_rels = self.new_subtechnique_of_rels if section != "deletions" else self.old_subtechnique_of_rels
             id_to_technique = self.new_id_to_technique if section != "deletions" else self.old_id_to_technique
@@ -397,7 +438,7 @@ class DiffStix(object):
                 """get a section list item for the given SDO according to section type"""
                 if section == "revocations":
                     revoker = item['revoked_by']
-                    if "x_mitre_is_subtechnique" in revoker and revoker["x_mitre_is_subtechnique"]:
+                    if revoker.get("x_mitre_is_subtechnique"):
                         # get revoking technique's parent for display
                         parentID = list(filter(lambda rel: rel["source_ref"] == revoker["id"], subtechnique_of_rels))[0]["target_ref"]
                         parentName = id_to_technique[parentID]["name"] if parentID in id_to_technique else "ERROR NO PARENT"
@@ -407,55 +448,57 @@ class DiffStix(object):
                 if section == "deletions":
                     return f"{item['name']}"
                 else:
-                    is_subtechnique = item["type"] == "attack-pattern" and "x_mitre_is_subtechnique" in item and item["x_mitre_is_subtechnique"]
+                    is_subtechnique = item["type"] == "attack-pattern" and item.get("x_mitre_is_subtechnique")
                     return f"[{item['name']}]({self.site_prefix}/{self.getUrlFromStix(item, is_subtechnique)})"
 
 
             # build sectionList string
-            sectionString = ""
+            sectionLines = []
             for grouping in groupings:
                 if grouping["parentInSection"]:
-                    sectionString += f"* { placard(grouping['parent']) }\n"
+                    sectionLines.append(f"* { placard(grouping['parent']) }\n")
                 # else:
-                #     sectionString += f"* _{grouping['parent']['name']}_\n"
+                #     sectionLines.append(f"* _{grouping['parent']['name']}_\n")
                 for child in sorted(grouping["children"], key=lambda child: child["name"]):
                     if grouping["parentInSection"]:
-                        sectionString += f"\t* {placard(child) }\n"
+                        sectionLines.append(f"\t* {placard(child) }\n")
                     else:
-                        sectionString += f"* { grouping['parent']['name'] }: { placard(child) }\n"
+                        sectionLines.append(f"* { grouping['parent']['name'] }: { placard(child) }\n")
 
-            return sectionString
+            return "".join(sectionLines)
 
         self.verboseprint("generating markdown string... ", end="", flush="true")
 
-        content = ""
+        # ids of techniques which have sub-techniques in the new data, used by getSectionList
+        parent_ids = {rel["target_ref"] for rel in self.new_subtechnique_of_rels}
+
+        # format the type and section headers once rather than for every section
+        type_headers = {obj_type: attackTypeToPlural[obj_type].capitalize() for obj_type in self.data}
+        section_headers = {} # (section, obj_type) => header
+        for obj_type in self.data:
+            for section, header in sectionNameToSectionHeaders.items():
+                header_type = type_headers[obj_type] if section == "additions" else obj_type.capitalize()
+                section_headers[(section, obj_type)] = header.replace("{obj_type}", header_type) + ":"
+
+        # collect the output in chunks and join them once at the end
+        content = []
+        if self.show_key:
+            content.append(f"{self.get_md_key()}\n\n")
         for obj_type in self.data.keys():
-            domains = ""
+            content.append(f"### {type_headers[obj_type]}\n\n") # e.g "techniques"
             for domain in self.data[obj_type]:
-                domain_sections = ""
+                content.append(f"**{domainToDomainLabel[domain]}**\n\n") # e.g "enterprise"
                 for section in self.data[obj_type][domain]:
+                    header = section_headers[(section, obj_type)]
                     if len(self.data[obj_type][domain][section]) > 0: # if there are items in the section
                         section_items = getSectionList(self.data[obj_type][domain][section], obj_type, section)
+                        content.append(f"{header}\n\n{section_items}\n\n") # add empty line between header and section list
                     else: # no items in section
-                        section_items = "No changes"
-                    header = sectionNameToSectionHeaders[section] + ":"
-                    if "{obj_type}" in header:
-                        if section == "additions":
-                            header = header.replace("{obj_type}", attackTypeToPlural[obj_type].capitalize())
-                        else: header = header.replace("{obj_type}", obj_type.capitalize())
-                    if section_items == "No changes":
-                        domain_sections += f"{header}\n{section_items}\n\n" # e.g "added techniques:"
-                    else: domain_sections += f"{header}\n\n{section_items}\n\n" # add empty line between header and section list
-                domains += f"**{domainToDomainLabel[domain]}**\n\n{domain_sections}" # e.g "enterprise"
-            content += f"### {attackTypeToPlural[obj_type].capitalize()}\n\n{domains}" # e.g "techniques"
-
-        if self.show_key:
-            key_content = self.get_md_key()
-            content = f"{key_content}\n\n{content}"
+                        content.append(f"{header}\nNo changes\n\n") # e.g "added techniques:"
 
         self.verboseprint("done")
 
-        return content
+        return "".join(content)
 
 
     def get_layers_dict(self):
@@ -474,19 +517,20 @@ class DiffStix(object):
             used_statuses = set()
             for status in self.data["technique"][domain]:
                 if status == "revocations" or status == "deprecations": continue
+                # fields shared by every technique with this status
+                status_fields = {
+                    "enabled": True,
+                    "color": statusToColor[status],
+                    "comment": status[:-1] # trim s off end of word
+                }
                 for technique in self.data["technique"][domain][status]:
+                    techniqueID = technique['external_references'][0]['external_id']
                     for phase in technique['kill_chain_phases']:
-                        techniques.append({
-                            "techniqueID": technique['external_references'][0]['external_id'],
-                            "tactic": phase['phase_name'],
-                            "enabled": True,
-                            "color": statusToColor[status],
-                            "comment": status[:-1] # trim s off end of word
-                        })
+                        techniques.append({"techniqueID": techniqueID, "tactic": phase['phase_name'], **status_fields})
                         used_statuses.add(status)
 
             # build legend based off used_statuses
-            legendItems = list(map(lambda status: {"color": statusToColor[status], "label": status + ": " + statusDescriptions[status]}, used_statuses))
+            legendItems = [statusToLegendItem[status] for status in used_statuses]
 
             # build layer structure
             layer_json = {
@@ -521,9 +565,8 @@ def markdown_string_to_file(outfile, content):
 
     verboseprint("writing markdown string to file... ", end="", flush="true")
 
-    outfile = open(outfile, "w")
-    outfile.write(content)
-    outfile.close()
+    with open(outfile, "w") as f:
+        f.write(content)
 
     verboseprint("done")
 
@@ -535,10 +578,14 @@ def layers_dict_to_files(outfiles, layers):
 
     verboseprint("writing layers dict to layer files... ", end="", flush="true")
 
-    # write each layer to separate files
-    json.dump(layers['enterprise-attack'], open(outfiles[0], "w"), indent=4)
-    json.dump(layers['mobile-attack'], open(outfiles[1], "w"), indent=4)
-    json.dump(layers['pre-attack'], open(outfiles[2], "w"), indent=4)
+    def dump_layer(layer, outfile):
+        with open(outfile, "w", encoding="utf-8") as f:
+            json.dump(layer, f, indent=2, check_circular=False, ensure_ascii=False)
+
+    # write each layer to separate files, skipping domains which weren't loaded
+    for outfile, domain in zip(outfiles, ('enterprise-attack', 'mobile-attack', 'pre-attack')):
+        if domain in layers:
+            dump_layer(layers[domain], outfile)
 
     verboseprint("done")
 
@@ -679,11 +726,11 @@ if __name__ == '__main__':
         markdown_string_to_file(args.markdown, md_string)
 
     if args.layers is not None:
-        if len(args.layers) is 0:
+        if len(args.layers) == 0:
             # no files specified, e.g. '-layers', use defaults
             diffStix.layers = layer_defaults
             args.layers = layer_defaults
-        elif len(args.layers) is 3:
+        elif len(args.layers) == 3:
             # files specified, e.g. '-layers file.json file2.json file3.json', use specified
             diffStix.layers = args.layers       # assumes order of files is enterprise, mobile, pre attack (same order as defaults)
         else: